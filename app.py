@@ -3,98 +3,195 @@ import pandas as pd
 import ezdxf
 import tempfile
 import os
+import re
 from pyproj import Transformer
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-transformer = Transformer.from_crs("EPSG:4326", "EPSG:2248", always_xy=True)
-
-def parse_geometry(geometry_str):
-    if geometry_str.startswith("POINTZ"):
-        coords = geometry_str.strip("POINTZ() ").split()
-        return [(float(coords[0]), float(coords[1]), float(coords[2]))]
-    elif geometry_str.startswith("LINESTRINGZ"):
-        coords = geometry_str.strip("LINESTRINGZ() ").split(",")
-        return [tuple(map(float, c.strip().split())) for c in coords]
-    elif geometry_str.startswith("POLYGONZ"):
-        coords = geometry_str.strip("POLYGONZ() ").strip("(").strip(")").split(",")
-        return [tuple(map(float, c.strip().split())) for c in coords]
-    else:
-        return []
+TYPE_NAMES = {'POINTZ': 'Point', 'LINESTRINGZ': 'Line', 'POLYGONZ': 'Polygon'}
+WKT_RE = re.compile(r'^(?P<kind>POINTZ|LINESTRINGZ|POLYGONZ)\s*\(+(?P<body>[^()]+)\)+\s*$')
+# A WKT coordinate body in which every comma-separated vertex has exactly three values
+VERTICES_RE = re.compile(r'\s*[^\s,]+\s+[^\s,]+\s+[^\s,]+\s*(?:,\s*[^\s,]+\s+[^\s,]+\s+[^\s,]+\s*)*')
+
+# Streamlit reruns the script on every widget change; cache_resource keeps one Transformer across reruns and sessions.
+# Sharing it between session threads is safe: pyproj (>= 3.1) keeps a separate PROJ handle per thread internally.
+@st.cache_resource
+def get_transformer():
+    return Transformer.from_crs("EPSG:4326", "EPSG:2248", always_xy=True)
+
+def parse_geometries(geometry):
+    # Parses a whole column of WKT strings at once. Returns the geometry type per row (NaN when unsupported),
+    # the vertex count per row and every vertex stacked row after row into one (N, 3) float array.
+    # Rows that start with a supported type must parse completely: trailing text, interior rings, points with
+    # several vertices or vertices without exactly three coordinates raise instead of being dropped
+    geometry = geometry.astype(str)
+    parts = geometry.str.extract(WKT_RE)
+    counts = (parts['body'].str.count(',') + 1).fillna(0).astype(int).to_numpy()
+    malformed = geometry.str.startswith(tuple(TYPE_NAMES)) & ~parts['body'].fillna('').str.fullmatch(VERTICES_RE)
+    malformed |= (parts['kind'] == 'POINTZ') & (counts > 1)
+    if malformed.any():
+        raise ValueError("Geometry must be a POINTZ, LINESTRINGZ or single-ring POLYGONZ with three coordinates "
+                         f"(lon lat elev) per vertex; check rows {list(geometry.index[malformed])}")
+    coords = np.array(' '.join(parts['body'].dropna()).replace(',', ' ').split(), dtype=float)
+    return parts['kind'].to_numpy(), counts, coords.reshape(-1, 3)
 
 def transform_point(lon, lat, elev, inst_ht):
-    x, y = transformer.transform(lon, lat)
-    z = (elev + 34.67 - inst_ht) * 3.28084
+    # Works on scalars as well as numpy arrays, so a whole file can be transformed in one call
+    x, y = get_transformer().transform(lon, lat)
+    # Fused in place: one output array, no temporaries for the intermediate sums.
+    # Evaluated as ((elev + 34.67) - inst_ht) * 3.28084 so results stay bit-identical to the scalar formula.
+    z = np.add(elev, 34.67)
+    z -= inst_ht
+    z *= 3.28084
     return x, y, z
 
-def add_point_marker(msp, x, y, z, size, layer, color):
-    msp.add_line((x - size, y - size, z), (x + size, y + size, z), dxfattribs={'layer': layer, 'color': color})
-    msp.add_line((x - size, y + size, z), (x + size, y - size, z), dxfattribs={'layer': layer, 'color': color})
+# The dxfattribs dicts are shared across calls; ezdxf copies them, so callers build them once per layer/color
+def add_point_marker(msp, x, y, z, size, dxfattribs):
+    # A single polyline draws the X: one diagonal, back to the centre, then the other diagonal
+    vertices = [(x - size, y - size), (x + size, y + size), (x, y), (x - size, y + size), (x + size, y - size)]
+    msp.add_lwpolyline(vertices, format='xy', dxfattribs=dxfattribs).dxf.elevation = z
+
+def add_text(msp, text, x, y, z, dxfattribs):
+    msp.add_text(text, dxfattribs={**dxfattribs, 'insert': (x, y, z)})
+
+def ensure_layer(doc, seen_layers, name, color):
+    # Layer names are case-insensitive in DXF, so seen_layers holds lowercased names
+    if name.lower() not in seen_layers:
+        doc.layers.new(name=name, dxfattribs={'color': color})
+        seen_layers.add(name.lower())
+
+def numeric_column(df, name, default):
+    # Blank cells and a missing column fall back to default; everything else gets a direct float cast
+    if name not in df.columns:
+        return np.full(len(df), default, dtype=float)
+    column = df[name]
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype=float)
+    text = column.astype(str).str.strip()
+    filled = (text.str.len() > 0).to_numpy()
+    values = np.full(len(df), default, dtype=float)
+    values[filled] = text[filled].astype(np.float64).to_numpy()
+    return values
+
+def read_csv(uploaded_file):
+    return pd.read_csv(uploaded_file, keep_default_na=False)
 
-def add_text(msp, text, x, y, z, txt_size, layer, color):
-    msp.add_text(text, dxfattribs={'layer': layer, 'height': txt_size, 'insert': (x, y, z), 'color': color})
+def read_csvs(uploaded_files, window=2):
+    # Yields the parsed uploads in order while the next ones are read on a thread pool (pandas' C parser releases
+    # the GIL). At most `window` reads are in flight, so only a couple of frames are held at once, not every upload.
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = deque()
+        for uploaded_file in uploaded_files:
+            pending.append(executor.submit(read_csv, uploaded_file))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
-def process_csvs(uploaded_files, marker_size, txt_size):
+def process_csvs(uploaded_files, marker_size, txt_size, binary_dxf=False):
     doc = ezdxf.new()
     msp = doc.modelspace()
-    all_records = []
+    summaries = []
+    seen_layers = set(layer.dxf.name.lower() for layer in doc.layers)
+    point_attribs = {color: {'layer': 'v-points', 'color': color} for color in (ezdxf.colors.RED, ezdxf.colors.YELLOW)}
+    point_text_attribs = {color: {**attribs, 'height': txt_size} for color, attribs in point_attribs.items()}
 
-    for uploaded_file in uploaded_files:
-        df = pd.read_csv(uploaded_file, keep_default_na=False)
+    for df in read_csvs(uploaded_files):
         if 'Geometry' not in df.columns:
             continue
-        for _, row in df.iterrows():
-            name = row.get('Name', row.get('ID', ''))
-            remarks = row.get('Remarks', '')
-            inst_ht = float(row.get('Instrument Ht', 1.6))
-            geometry = row['Geometry']
-            coords = parse_geometry(geometry)
-            if geometry.startswith("POINTZ"):
-                lon, lat, elev = coords[0]
-                x, y, z = transform_point(lon, lat, elev, inst_ht)
-                fix = float(row.get('Fix ID', 0))
-                color = ezdxf.colors.RED if fix == 4 else ezdxf.colors.YELLOW
-                layer = 'v-points'
-                if layer not in doc.layers:
-                    doc.layers.new(name=layer, dxfattribs={'color': ezdxf.colors.YELLOW})
-                add_point_marker(msp, x, y, z, marker_size, layer, color)
-                add_text(msp, f"{z:.2f}", x + marker_size, y + marker_size, z, txt_size, layer, color)
-                if remarks:
-                    add_text(msp, remarks, x + marker_size, y - marker_size - txt_size, z, txt_size, layer, color)
-                all_records.append({'Type': 'Point', 'Name': name, 'Remarks': remarks, 'X_ft': x, 'Y_ft': y, 'Z_ft': z})
-            elif geometry.startswith("LINESTRINGZ"):
-                # For lines, third value is actually elevation, not width. Width fixed to 0.
-                vertices = [transform_point(lon, lat, elev, inst_ht) for lon, lat, elev in coords]
-                layer = f"v-lines-{name}"
-                if layer not in doc.layers:
-                    doc.layers.new(name=layer, dxfattribs={'color': ezdxf.colors.BLUE})
-                # Create polyline with width 0 and actual Z assigned from the elevation
-                lwpoly = msp.add_lwpolyline([(vx, vy) for vx, vy, vz in vertices], dxfattribs={'layer': layer, 'color': 256})
-                lwpoly.dxf.elevation = 0  # 2D polyline elevation baseline
-                for vx, vy, vz in vertices:
-                    msp.add_point((vx, vy, vz), dxfattribs={'layer': layer, 'color': 256})
-                    add_point_marker(msp, vx, vy, vz, marker_size, layer, ezdxf.colors.BLUE)
-                mid = vertices[len(vertices)//2]
-                add_text(msp, name, mid[0], mid[1], mid[2], txt_size, layer, ezdxf.colors.BLUE)
-                all_records.append({'Type': 'Line', 'Name': name, 'Remarks': remarks, 'Vertices': vertices})
-            elif geometry.startswith("POLYGONZ"):
-                vertices = [transform_point(lon, lat, elev, inst_ht) for lon, lat, elev in coords]
-                layer = f"v-polygons-{name}"
-                if layer not in doc.layers:
-                    doc.layers.new(name=layer, dxfattribs={'color': ezdxf.colors.GREEN})
-                msp.add_lwpolyline([(vx, vy) for vx, vy, vz in vertices], close=True, dxfattribs={'layer': layer, 'color': 256})
-                for vx, vy, vz in vertices:
-                    add_point_marker(msp, vx, vy, vz, marker_size, layer, ezdxf.colors.GREEN)
-                centroid_x = np.mean([vx for vx, vy, vz in vertices])
-                centroid_y = np.mean([vy for vx, vy, vz in vertices])
-                centroid_z = np.mean([vz for vx, vy, vz in vertices])
-                add_text(msp, f"{name}\n{remarks}", centroid_x, centroid_y, centroid_z, txt_size, layer, ezdxf.colors.GREEN)
-                all_records.append({'Type': 'Polygon', 'Name': name, 'Remarks': remarks, 'Vertices': vertices})
-
-    temp_dxf = tempfile.NamedTemporaryFile(delete=False, suffix=".dxf")
-    doc.saveas(temp_dxf.name)
-    df_out = pd.DataFrame(all_records)
-    temp_csv = tempfile.NamedTemporaryFile(delete=False, suffix=".csv", mode="w", newline="", encoding="utf-8")
-    df_out.to_csv(temp_csv.name, index=False)
+        # Parse every geometry up front and transform all vertices of the file in a single call
+        kinds, counts, flat = parse_geometries(df['Geometry'])
+        starts = np.cumsum(counts) - counts
+        inst_hts = numeric_column(df, 'Instrument Ht', 1.6)
+        xs, ys, zs = transform_point(flat[:, 0], flat[:, 1], flat[:, 2], np.repeat(inst_hts, counts))
+        # Pull each column out once instead of boxing every row into a Series
+        blank = pd.Series('', index=df.index)
+        all_names = df.get('Name', df.get('ID', blank)).to_numpy()
+        all_remarks = df.get('Remarks', blank).to_numpy()
+        all_fixes = numeric_column(df, 'Fix ID', 0)
+        all_colors = np.where(all_fixes == 4, ezdxf.colors.RED, ezdxf.colors.YELLOW)
+        all_vertices = np.full(len(df), np.nan, dtype=object)
+        ends = starts + counts
+
+        # Rows are split by geometry type once, then each type is drawn in its own loop
+        is_point = kinds == "POINTZ"
+        if is_point.any():
+            ensure_layer(doc, seen_layers, 'v-points', ezdxf.colors.YELLOW)
+        pt = starts[is_point]
+        # Elevation labels only for point rows, formatted on Python floats in one comprehension
+        z_labels = [f"{z:.2f}" for z in zs[pt].tolist()]
+        for x, y, z, label, remarks, color in zip(xs[pt], ys[pt], zs[pt], z_labels, all_remarks[is_point], all_colors[is_point]):
+            add_point_marker(msp, x, y, z, marker_size, point_attribs[color])
+            add_text(msp, label, x + marker_size, y + marker_size, z, point_text_attribs[color])
+            if remarks:
+                add_text(msp, remarks, x + marker_size, y - marker_size - txt_size, z, point_text_attribs[color])
+
+        for i in np.flatnonzero(kinds == "LINESTRINGZ"):
+            name, start, end = all_names[i], starts[i], ends[i]
+            # For lines, third value is actually elevation, not width. Width fixed to 0.
+            vertices = list(zip(xs[start:end].tolist(), ys[start:end].tolist(), zs[start:end].tolist()))
+            layer = f"v-lines-{name}"
+            ensure_layer(doc, seen_layers, layer, ezdxf.colors.BLUE)
+            bylayer_attribs = {'layer': layer, 'color': 256}
+            marker_attribs = {'layer': layer, 'color': ezdxf.colors.BLUE}
+            # Create polyline with width 0 and actual Z assigned from the elevation
+            lwpoly = msp.add_lwpolyline([(vx, vy) for vx, vy, vz in vertices], dxfattribs=bylayer_attribs)
+            lwpoly.dxf.elevation = 0  # 2D polyline elevation baseline
+            for vx, vy, vz in vertices:
+                msp.add_point((vx, vy, vz), dxfattribs=bylayer_attribs)
+                add_point_marker(msp, vx, vy, vz, marker_size, marker_attribs)
+            mid = vertices[len(vertices)//2]
+            add_text(msp, name, mid[0], mid[1], mid[2], {**marker_attribs, 'height': txt_size})
+            all_vertices[i] = vertices
+
+        for i in np.flatnonzero(kinds == "POLYGONZ"):
+            name, remarks, start, end = all_names[i], all_remarks[i], starts[i], ends[i]
+            polygon = np.column_stack((xs[start:end], ys[start:end], zs[start:end]))
+            vertices = list(map(tuple, polygon.tolist()))
+            layer = f"v-polygons-{name}"
+            ensure_layer(doc, seen_layers, layer, ezdxf.colors.GREEN)
+            marker_attribs = {'layer': layer, 'color': ezdxf.colors.GREEN}
+            msp.add_lwpolyline(polygon[:, :2].tolist(), close=True, dxfattribs={'layer': layer, 'color': 256})
+            for vx, vy, vz in vertices:
+                add_point_marker(msp, vx, vy, vz, marker_size, marker_attribs)
+            centroid_x, centroid_y, centroid_z = polygon.mean(axis=0)
+            add_text(msp, f"{name}\n{remarks}", centroid_x, centroid_y, centroid_z, {**marker_attribs, 'height': txt_size})
+            all_vertices[i] = vertices
+
+        # Summary rows are assembled column-wise; points carry X/Y/Z, lines and polygons their vertex list
+        point_coords = {}
+        for column, values in (('X_ft', xs), ('Y_ft', ys), ('Z_ft', zs)):
+            point_coords[column] = np.full(len(df), np.nan)
+            point_coords[column][is_point] = values[starts[is_point]]
+        summary = pd.DataFrame({'Type': pd.Series(kinds).map(TYPE_NAMES), 'Name': all_names, 'Remarks': all_remarks,
+                                **point_coords, 'Vertices': all_vertices})
+        summaries.append(summary[pd.notna(kinds)])
+
+    if binary_dxf:
+        # Binary DXF skips all float-to-text formatting; AutoCAD reads it, but not every DXF consumer does
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".dxf", buffering=1 << 20) as temp_dxf:
+            doc.write(temp_dxf, fmt='bin')
+    else:
+        # Same encoding and error handler as doc.saveas, but through a 1 MB buffer
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".dxf", mode="w", encoding=doc.output_encoding,
+                                         errors="dxfreplace", buffering=1 << 20) as temp_dxf:
+            doc.write(temp_dxf)
+    df_out = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame()
+    if df_out.empty:
+        df_out = pd.DataFrame()
+    else:
+        # Keep the record layout: coordinate and vertex columns only when used, in the order they first appear
+        is_point = (df_out['Type'] == 'Point').to_numpy()
+        optional = []
+        if is_point.any():
+            optional.append((is_point.argmax(), ['X_ft', 'Y_ft', 'Z_ft']))
+        if not is_point.all():
+            optional.append(((~is_point).argmax(), ['Vertices']))
+        df_out = df_out[['Type', 'Name', 'Remarks'] + [c for _, columns in sorted(optional) for c in columns]]
+    # Write through a 1 MB buffer in chunks so pandas flushes in bulk instead of per row
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".csv", mode="w", newline="", encoding="utf-8", buffering=1 << 20) as temp_csv:
+        df_out.to_csv(temp_csv, index=False, chunksize=50000)
     return temp_dxf.name, temp_csv.name
 
 # --- Streamlit App ---
@@ -109,12 +206,13 @@ marker_size = st.slider("Marker Size", 0.01, 1.0, 0.05)
 txt_size = st.slider("Text Size", 0.1, 2.0, 0.3)
 output_dxf_name = st.text_input("Output DXF filename", "combined_output.dxf")
 output_csv_name = st.text_input("Output CSV filename", "combined_summary.csv")
+binary_dxf = st.checkbox("Binary DXF (smaller and faster, not supported by every DXF reader)", value=False)
 
 uploaded_files = st.file_uploader("Upload CSV files (points, lines, polygons)", type="csv", accept_multiple_files=True)
 
 if st.button("Generate DXF") and uploaded_files:
     with st.spinner("Processing and generating DXF..."):
-        dxf_file, csv_file = process_csvs(uploaded_files, marker_size, txt_size)
+        dxf_file, csv_file = process_csvs(uploaded_files, marker_size, txt_size, binary_dxf)
         st.session_state.dxf_path = dxf_file
         st.session_state.csv_path = csv_file
         st.success("DXF and CSV generated successfully. Scroll down to download.")